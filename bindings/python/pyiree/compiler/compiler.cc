@@ -353,9 +353,15 @@ std::shared_ptr<OpaqueBlob> CompilerModuleBundle::Compile(
       pass_manager, executable_options);
   mlir::iree_compiler::IREE::VM::buildVMTransformPassPipeline(pass_manager);
 
-  // Run primary passes.
+  // Run primary passes. The GIL is released so that modules can be compiled
+  // concurrently from multiple Python threads.
   auto diag_capture = context_->CaptureDiagnostics();
-  if (failed(pass_manager.run(module_op_))) {
+  bool run_failed;
+  {
+    py::gil_scoped_release release;
+    run_failed = failed(pass_manager.run(module_op_));
+  }
+  if (run_failed) {
     throw RaisePyError(
         PyExc_RuntimeError,
         diag_capture.ConsumeDiagnosticsAsString("Error compiling IREE module:")
@@ -396,9 +402,14 @@ void CompilerModuleBundle::RunPassPipeline(
     }
   }
 
-  // Run them.
+  // Run them (without holding the GIL).
   auto diag_capture = context_->CaptureDiagnostics();
-  if (failed(pm.run(module_op_))) {
+  bool run_failed;
+  {
+    py::gil_scoped_release release;
+    run_failed = failed(pm.run(module_op_));
+  }
+  if (run_failed) {
     throw RaisePyError(
         PyExc_RuntimeError,
         diag_capture.ConsumeDiagnosticsAsString("Error running pass pipelines:")
@@ -138,9 +138,15 @@ std::unique_ptr<FunctionAbi> VmContext::CreateFunctionAbi(
 
 void VmContext::Invoke(iree_vm_function_t f, VmVariantList& inputs,
                        VmVariantList& outputs) {
-  CheckApiStatus(iree_vm_invoke(raw_ptr(), f, nullptr, inputs.raw_ptr(),
-                                outputs.raw_ptr(), IREE_ALLOCATOR_SYSTEM),
-                 "Error invoking function");
+  // Release the GIL so that functions can be invoked concurrently from
+  // multiple Python threads.
+  iree_status_t status;
+  {
+    py::gil_scoped_release release;
+    status = iree_vm_invoke(raw_ptr(), f, nullptr, inputs.raw_ptr(),
+                            outputs.raw_ptr(), IREE_ALLOCATOR_SYSTEM);
+  }
+  CheckApiStatus(status, "Error invoking function");
 }
 
 //------------------------------------------------------------------------------
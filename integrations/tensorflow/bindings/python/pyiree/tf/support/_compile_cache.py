@@ -0,0 +1,203 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Persistent on-disk cache of compiled IREE modules.
+
+Compiling a tf.Module is far more expensive than hashing its source, so
+compiled modules can be stored on disk keyed by what influences the
+compilation: the source of the module defining the constructor, the flags
+defined by that module, the exported names, the target backends, the
+TensorFlow version and the compiler binary itself.
+
+Anything else the constructor depends on (e.g. downloaded weights or library
+code outside its module) is not part of the key, which is why the cache is
+opt-in.
+"""
+
+import hashlib
+import inspect
+import mmap
+import os
+import shutil
+import tempfile
+
+from absl import flags
+from absl import logging
+from pyiree.tf import compiler
+import tensorflow.compat.v2 as tf
+
+FLAGS = flags.FLAGS
+
+
+def _get_compiler_stamp():
+  """Returns a string identifying the compiler build in use."""
+  binding_path = getattr(compiler.binding, "__file__", None)
+  if not binding_path:
+    return ""
+  return "%s:%d" % (binding_path, os.stat(binding_path).st_mtime_ns)
+
+
+def _get_module_flags(module):
+  """Serializes the flags defined by module, which may configure the ctor."""
+  module_flags = FLAGS.get_flags_for_module(module)
+  return "\n".join(sorted(flag.serialize() for flag in module_flags))
+
+
+def get_cache_key(ctor, exported_names, target_backends):
+  """Computes the cache key for compiling ctor for target_backends.
+
+  Args:
+    ctor: The tf.Module constructor.
+    exported_names: Iterable of dotted function names to consider for
+      compilation.
+    target_backends: Iterable of string backend names to compile for.
+
+  Returns:
+    A hex digest, or None if ctor cannot be identified by its source (in which
+    case the compiled module should not be cached).
+  """
+  # Lambdas and nested definitions do not have unique qualified names (e.g.
+  # two lambdas in one test, or closures over different values from one
+  # factory), so they would share a key.
+  qualname = getattr(ctor, "__qualname__", None)
+  if not qualname or "<lambda>" in qualname or "<locals>" in qualname:
+    return None
+  module = inspect.getmodule(ctor)
+  try:
+    source = inspect.getsource(module)
+  except (OSError, TypeError):
+    return None
+  hasher = hashlib.sha256()
+  for part in (source, qualname,
+               repr(sorted(exported_names)), repr(list(target_backends)),
+               _get_module_flags(module), tf.__version__,
+               _get_compiler_stamp()):
+    hasher.update(part.encode("utf-8"))
+    hasher.update(b"\0")
+  return hasher.hexdigest()
+
+
+def _map_file(f):
+  """Maps the open file f read-only into memory."""
+  return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _map_blob(blob):
+  """Maps blob from an anonymous temporary file, or returns it on failure."""
+  try:
+    with tempfile.TemporaryFile() as f:
+      f.write(blob)
+      f.flush()
+      return _map_file(f)
+  except OSError:
+    logging.exception("Error mapping compiled module, keeping it in memory")
+    return blob
+
+
+def _atomic_copy(src_path, dst_path):
+  """Copies src_path to dst_path such that readers never see a partial file."""
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst_path))
+  os.close(fd)
+  try:
+    shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dst_path)
+  except:
+    os.remove(tmp_path)
+    raise
+
+
+def _load(module_path, cached_artifacts):
+  """Returns the cached module at module_path, or None on a miss."""
+  if not (os.path.exists(module_path) and
+          all(os.path.exists(c) for c, _ in cached_artifacts)):
+    return None
+  logging.info("Using cached compiled module: %s", module_path)
+  for cached_path, artifact_path in cached_artifacts:
+    shutil.copyfile(cached_path, artifact_path)
+  with open(module_path, "rb") as f:
+    return _map_file(f)
+
+
+def _store(module_path, cached_artifacts, compiled_module):
+  """Stores compiled_module at module_path and returns it mapped."""
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(module_path))
+  try:
+    with os.fdopen(fd, "wb") as f:
+      f.write(compiled_module)
+    os.replace(tmp_path, module_path)
+  except:
+    os.remove(tmp_path)
+    raise
+  for cached_path, artifact_path in cached_artifacts:
+    if os.path.exists(artifact_path):
+      _atomic_copy(artifact_path, cached_path)
+  logging.info("Cached compiled module: %s", module_path)
+  with open(module_path, "rb") as f:
+    return _map_file(f)
+
+
+def get_or_compile(ctor,
+                   exported_names,
+                   target_backends,
+                   compile_fn,
+                   cache_dir=None,
+                   debug_artifacts=()):
+  """Returns the compiled module for ctor, compiling it only on a cache miss.
+
+  Errors accessing the cache are logged and fall back to compiling.
+
+  Args:
+    ctor: The tf.Module constructor.
+    exported_names: Iterable of dotted function names to consider for
+      compilation.
+    target_backends: Iterable of string backend names to compile for.
+    compile_fn: Function taking no arguments which compiles the module and
+      returns the compiled flatbuffer.
+    cache_dir: Directory to cache compiled modules in. Caching is disabled if
+      None.
+    debug_artifacts: Paths of the debug artifacts written by compile_fn. These
+      are stored alongside the compiled module and restored on a cache hit.
+
+  Returns:
+    A buffer with the compiled flatbuffer. This is normally a read-only
+    mmap.mmap, which lets the OS page the flatbuffer in and out rather than
+    holding it in memory.
+  """
+  key = None
+  if cache_dir:
+    key = get_cache_key(ctor, exported_names, target_backends)
+    if key is None:
+      logging.info("Not caching compiled module for %r: no unique source",
+                   ctor)
+  if key is None:
+    return _map_blob(compile_fn())
+
+  module_path = os.path.join(cache_dir, key + ".vmfb")
+  cached_artifacts = [(os.path.join(cache_dir,
+                                    "%s__%s" % (key, os.path.basename(p))), p)
+                      for p in debug_artifacts]
+  try:
+    os.makedirs(cache_dir, exist_ok=True)
+    cached_module = _load(module_path, cached_artifacts)
+    if cached_module is not None:
+      return cached_module
+  except OSError:
+    logging.exception("Error reading compile cache: %s", cache_dir)
+
+  compiled_module = compile_fn()
+  try:
+    return _store(module_path, cached_artifacts, compiled_module)
+  except OSError:
+    logging.exception("Error writing compile cache: %s", cache_dir)
+    return _map_blob(compiled_module)
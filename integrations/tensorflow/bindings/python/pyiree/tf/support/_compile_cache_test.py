@@ -0,0 +1,87 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for pyiree.tf.support._compile_cache."""
+
+from pyiree.tf.support import _compile_cache
+import tensorflow as tf
+
+
+class CompileCacheTestModule(tf.Module):
+  pass
+
+
+class CompileCacheTest(tf.test.TestCase):
+
+  def _get_or_compile(self, ctor, target_backends, cache_dir):
+    self.compile_count = getattr(self, 'compile_count', 0)
+
+    def compile_fn():
+      self.compile_count += 1
+      return b'flatbuffer'
+
+    return bytes(
+        _compile_cache.get_or_compile(
+            ctor, (), target_backends, compile_fn, cache_dir=cache_dir))
+
+  def test_compile_cache(self):
+    cache_dir = self.create_tempdir().full_path
+    # Miss.
+    self.assertEqual(
+        b'flatbuffer',
+        self._get_or_compile(CompileCacheTestModule, ['vmla'], cache_dir))
+    self.assertEqual(1, self.compile_count)
+    # Hit.
+    self.assertEqual(
+        b'flatbuffer',
+        self._get_or_compile(CompileCacheTestModule, ['vmla'], cache_dir))
+    self.assertEqual(1, self.compile_count)
+    # Miss for another backend.
+    self._get_or_compile(CompileCacheTestModule, ['llvm-ir'], cache_dir)
+    self.assertEqual(2, self.compile_count)
+
+  def test_compile_cache_uncacheable_ctor(self):
+    cache_dir = self.create_tempdir().full_path
+    # The source of builtins is not available.
+    self.assertIsNone(_compile_cache.get_cache_key(dict, (), ['vmla']))
+    self._get_or_compile(dict, ['vmla'], cache_dir)
+    self._get_or_compile(dict, ['vmla'], cache_dir)
+    self.assertEqual(2, self.compile_count)
+
+  def test_compile_cache_lambda_ctors(self):
+    cache_dir = self.create_tempdir().full_path
+    # Lambdas share a qualified name, so they must not share a cache entry.
+    ctor_a = lambda: CompileCacheTestModule(name='a')
+    ctor_b = lambda: CompileCacheTestModule(name='b')
+    self.assertIsNone(_compile_cache.get_cache_key(ctor_a, (), ['vmla']))
+    self._get_or_compile(ctor_a, ['vmla'], cache_dir)
+    self._get_or_compile(ctor_b, ['vmla'], cache_dir)
+    self.assertEqual(2, self.compile_count)
+
+  def test_compile_cache_unwritable(self):
+    # A cache dir nested under a regular file cannot be created.
+    cache_dir = self.create_tempfile().full_path + '/cache'
+    self.assertEqual(
+        b'flatbuffer',
+        self._get_or_compile(CompileCacheTestModule, ['vmla'], cache_dir))
+    self.assertEqual(1, self.compile_count)
+
+  def test_compile_cache_disabled(self):
+    self._get_or_compile(CompileCacheTestModule, ['vmla'], None)
+    self._get_or_compile(CompileCacheTestModule, ['vmla'], None)
+    self.assertEqual(2, self.compile_count)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -19,17 +19,24 @@
 # pylint: disable=missing-docstring
 # pylint: disable=protected-access
 
+import atexit
 import collections
+import concurrent.futures
+import functools
+import hashlib
 import os
 import random
 import re
+import shutil
 import tempfile
+import threading
 
 from absl import flags
 from absl import logging
 import numpy as np
 from pyiree import rt
 from pyiree.tf import compiler
+from pyiree.tf.support import _compile_cache
 import tensorflow.compat.v2 as tf
 
 flags.DEFINE_string("target_backends", None,
@@ -38,13 +45,55 @@ flags.DEFINE_string(
     "debug_dir", None,
     "Specifies a directory to dump debug artifacts to. Defaults to "
     "--test_tmpdir")
+flags.DEFINE_boolean(
+    "dump_debug_artifacts", True,
+    "Whether to dump MLIR, compiled modules and crash reproducers to the debug "
+    "directory. Disabling this skips printing the raw TF MLIR and writing "
+    "debug artifacts.")
+flags.DEFINE_string(
+    "compile_cache_dir", None,
+    "Directory to cache compiled IREE modules in across runs. Entries are "
+    "keyed on the source and flags of the module defining the tf.Module "
+    "constructor but not on data it loads (e.g. weight files), and are never "
+    "pruned. Disabled by default.")
 FLAGS = flags.FLAGS
 
 ORIGINAL_SAVED_MODEL_PATH_ATTR = "_ORIGINAL_SAVED_MODEL_PATH"
 
+# Leaves with more elements than this are compared individually rather than
+# concatenated with the other leaves of a result.
+_MAX_BATCHED_LEAF_SIZE = 1 << 12
+
+# Matches runs of characters that are not allowed in debug artifact names.
+_SANITIZE_NAME_RE = re.compile(r"[^0-9a-zA-Z_]+")
+
 # Per test directory where debug artifacts are dumped.
 global_debug_dir = None
 
+# Serializes saving tf.Modules, which may be compiled from multiple threads.
+_saved_model_lock = threading.Lock()
+
+# A SavedModel lowered to the IREE input dialects, as MLIR text from before
+# and after running TF_IMPORT_PASS_PIPELINE. An import used by a single
+# compilation instead holds the lowered compiler module itself.
+_ImportedModule = collections.namedtuple(
+    "_ImportedModule", ["raw_asm", "input_asm", "compiler_module"])
+
+# Whether imports are shared by multiple IREE backends (and so must be cached
+# and parsed by each). Set by setUpClass for the module being compiled.
+_share_imported_modules = True
+
+# LRU cache of _ImportedModules keyed by (sm_path, mtime, exported_names).
+# The imported IR includes all weights, so only the module whose backends are
+# being compiled is kept; setUpClass clears it once they are done.
+_IMPORTED_MODULE_CACHE_SIZE = 1
+_imported_module_cache = collections.OrderedDict()
+_imported_module_lock = threading.Lock()
+
+# Maps id(ctor) to a (ctor, saved_model_path) tuple for every module
+# constructor that has been saved by _get_saved_model_path.
+_saved_model_path_cache = {}
+
 
 def set_random_seed(seed=0):
   """Set random seed for tf, np and random."""
@@ -53,82 +102,262 @@ def set_random_seed(seed=0):
   np.random.seed(seed)
 
 
-def save_and_compile_tf_module(tf_module, exported_names=(),
-                               target_backends=()):
-  """Saves and compiles a TensorFlow tf.Module.
+def _write_if_changed(path, data):
+  """Writes data to path unless the file already has exactly that content.
 
-  Note that if the module has the special _ORIGINAL_SAVED_MODEL_PATH attribute,
-  then it will be compiled directly from that path instead of saved and then
-  loaded.
+  A digest of the last write is kept alongside in path + ".sig" so that
+  unchanged (and potentially large) debug artifacts are not rewritten.
+
+  Args:
+    path: The file to write.
+    data: A str (written as text) or bytes-like object (written as binary).
+  """
+  binary = not isinstance(data, str)
+  data_bytes = memoryview(data if binary else data.encode("utf-8"))
+  sig = hashlib.blake2b(data_bytes).digest()
+  sig_path = path + ".sig"
+  # The file must have the expected size and must not have been modified
+  # since the signature was written. The mtime comparison is strict so that
+  # an edit within the same (possibly coarse) timestamp tick is not missed.
+  if (os.path.exists(path) and os.path.exists(sig_path) and
+      os.stat(path).st_size == data_bytes.nbytes and
+      os.stat(path).st_mtime_ns < os.stat(sig_path).st_mtime_ns):
+    with open(sig_path, "rb") as f:
+      if f.read() == sig:
+        return
+  with open(path, "wb" if binary else "w") as f:
+    f.write(data)
+  with open(sig_path, "wb") as f:
+    f.write(sig)
+
+
+@functools.lru_cache(maxsize=None)
+def _flatten_target_backends(target_backends):
+  """Joins target_backends into a string usable in file names."""
+  return _SANITIZE_NAME_RE.sub("_", "__".join(target_backends))
+
+
+def _get_debug_artifact_paths(target_backends):
+  """Returns the paths of the debug artifacts dumped when compiling.
 
   Args:
-    tf_module: A tf.Module.
-    exported_names: Iterable of dotted function names to consider for
-      compilation.
     target_backends: Iterable of string backend names to compile for.
 
   Returns:
-    An _IreeCompiledModule.
+    A (raw_mlir_path, input_mlir_path, compiled_path) tuple, or None if debug
+    artifacts are not being dumped.
   """
+  if not global_debug_dir:
+    return None
+  flattened_target_backends = _flatten_target_backends(tuple(target_backends))
+  return (os.path.join(global_debug_dir,
+                       "raw__%s.mlir" % flattened_target_backends),
+          os.path.join(global_debug_dir,
+                       "input__%s.mlir" % flattened_target_backends),
+          os.path.join(global_debug_dir,
+                       "compiled__%s.vmfb" % flattened_target_backends))
 
-  def compile_from_path(sm_path):
-    compiler_context = compiler.Context()
-    # Break up the compilation so we can save debug artifacts.
+
+def _import_module(sm_path, exported_names, cache=True):
+  """Imports a SavedModel and lowers it to the IREE input dialects.
+
+  The imported module does not depend on the target backend, so it is cached
+  and shared by the compilations for every backend.
+
+  Args:
+    sm_path: The SavedModel path.
+    exported_names: Iterable of dotted function names to consider for
+      compilation.
+    cache: Whether to cache the result for compiling other backends.
+
+  Returns:
+    An _ImportedModule. raw_asm is only populated when debug artifacts are
+    being dumped. input_asm is rendered once and used both to create the
+    per-backend modules and as the input MLIR debug artifact. If the import is
+    neither cached nor dumped, only compiler_module is populated.
+  """
+  pb_path = os.path.join(sm_path, "saved_model.pb")
+  mtime = os.stat(pb_path if os.path.exists(pb_path) else sm_path).st_mtime_ns
+  key = (sm_path, mtime, tuple(exported_names))
+  with _imported_module_lock:
+    imported = _imported_module_cache.get(key)
+    if imported is not None and (imported.raw_asm is not None or
+                                 not global_debug_dir):
+      _imported_module_cache.move_to_end(key)
+      return imported
+
+    # Break up the import so we can save debug artifacts.
     compiler_module = compiler.tf_load_saved_model(
         sm_path,
         exported_names=exported_names,
-        compiler_context=compiler_context,
+        compiler_context=compiler.Context(),
         pass_pipeline=())
-
-    # Save the input MLIR module.
-    flattened_target_backends = re.sub("[^0-9a-zA-Z_]+", "_",
-                                       "__".join(target_backends))
-    if global_debug_dir:
-      mlir_path = os.path.join(global_debug_dir,
-                               "raw__%s.mlir" % flattened_target_backends)
-      logging.info("Saving raw TF input MLIR to: %s", mlir_path)
-      with open(mlir_path, "w") as f:
-        f.write(compiler_module.to_asm())
+    raw_asm = compiler_module.to_asm() if global_debug_dir else None
 
     # Now run the passes manually that tf_load_saved_model would usually do.
     compiler_module.run_pass_pipeline(compiler.TF_IMPORT_PASS_PIPELINE)
+    if not cache and not global_debug_dir:
+      # Only one compilation uses the import, so don't print and re-parse the
+      # module (including its weights).
+      return _ImportedModule(
+          raw_asm=None, input_asm=None, compiler_module=compiler_module)
+    imported = _ImportedModule(
+        raw_asm=raw_asm,
+        input_asm=compiler_module.to_asm(debug_info=True),
+        compiler_module=None)
+
+    if not cache:
+      return imported
+    _imported_module_cache[key] = imported
+    if len(_imported_module_cache) > _IMPORTED_MODULE_CACHE_SIZE:
+      _imported_module_cache.popitem(last=False)
+    return imported
+
+
+def _compile_for_backend(imported, target_backends):
+  """Compiles an _ImportedModule for target_backends, saving debug artifacts."""
+  if imported.compiler_module is not None:
+    compiler_module = imported.compiler_module
+  else:
+    # Compilation mutates the module, so each backend parses its own copy. The
+    # backends of a module are compiled concurrently, so each also gets its
+    # own crash reproducer.
+    compiler_context = compiler.Context()
+    crash_reproducer_path = compiler.Context.default_crash_reproducer_path
+    if crash_reproducer_path:
+      base, ext = os.path.splitext(crash_reproducer_path)
+      compiler_context.crash_reproducer_path = "%s__%s%s" % (
+          base, _flatten_target_backends(tuple(target_backends)), ext)
+    compiler_module = compiler_context.parse_asm(imported.input_asm)
+
+  # Save the input MLIR module.
+  debug_artifact_paths = _get_debug_artifact_paths(target_backends)
+  if debug_artifact_paths:
+    raw_mlir_path, input_mlir_path, compiled_path = debug_artifact_paths
+    logging.info("Saving raw TF input MLIR to: %s", raw_mlir_path)
+    _write_if_changed(raw_mlir_path, imported.raw_asm)
+
+    logging.info("Saving IREE input MLIR to: %s", input_mlir_path)
+    _write_if_changed(input_mlir_path, imported.input_asm)
+
+  compiled_module = compiler_module.compile(target_backends=target_backends)
+  if debug_artifact_paths:
+    logging.info("Saving compiled IREE module to: %s", compiled_path)
+    _write_if_changed(compiled_path, compiled_module)
+
+  return compiled_module
+
+
+def _compile_from_path(sm_path,
+                       exported_names,
+                       target_backends,
+                       cache_import=True):
+  """Compiles the SavedModel at sm_path, saving debug artifacts."""
+  return _compile_for_backend(
+      _import_module(sm_path, exported_names, cache=cache_import),
+      target_backends)
+
+
+def _clear_imported_module_cache():
+  with _imported_module_lock:
+    _imported_module_cache.clear()
 
-    if global_debug_dir:
-      mlir_path = os.path.join(global_debug_dir,
-                               "input__%s.mlir" % flattened_target_backends)
-      logging.info("Saving IREE input MLIR to: %s", mlir_path)
-      with open(mlir_path, "w") as f:
-        f.write(compiler_module.to_asm())
 
-    compiled_module = compiler_module.compile(target_backends=target_backends)
-    if global_debug_dir:
-      compiled_path = os.path.join(
-          global_debug_dir, "compiled__%s.vmfb" % flattened_target_backends)
-      logging.info("Saving compiled IREE module to: %s", compiled_path)
-      with open(compiled_path, "wb") as f:
-        f.write(compiled_module)
+def save_and_compile_tf_module(tf_module, exported_names=(),
+                               target_backends=()):
+  """Saves and compiles a TensorFlow tf.Module.
 
-    return compiled_module
+  Note that if the module has the special _ORIGINAL_SAVED_MODEL_PATH attribute,
+  then it will be compiled directly from that path instead of saved and then
+  loaded.
 
+  Args:
+    tf_module: A tf.Module.
+    exported_names: Iterable of dotted function names to consider for
+      compilation.
+    target_backends: Iterable of string backend names to compile for.
+
+  Returns:
+    An _IreeCompiledModule.
+  """
   if hasattr(tf_module, ORIGINAL_SAVED_MODEL_PATH_ATTR):
     # Compile directly from the original path.
     sm_path = getattr(tf_module, ORIGINAL_SAVED_MODEL_PATH_ATTR)
     logging.info(
         "Compiling from original saved_model path (not round-tripping): %s",
         sm_path)
-    return compile_from_path(sm_path)
+    return _compile_from_path(sm_path, exported_names, target_backends)
   else:
     options = tf.saved_model.SaveOptions(save_debug_info=True)
     if FLAGS.debug_dir is None:
       # Round-trip through a temporary directory.
       with tempfile.TemporaryDirectory() as sm_path:
-        tf.saved_model.save(tf_module, sm_path, options=options)
-        return compile_from_path(sm_path)
+        with _saved_model_lock:
+          tf.saved_model.save(tf_module, sm_path, options=options)
+        # The directory is deleted afterwards so the import cannot be reused.
+        return _compile_from_path(
+            sm_path, exported_names, target_backends, cache_import=False)
     else:
-      # Use the supplied directory.
+      # Use the supplied directory. It is shared by all compilations, so it
+      # must stay locked until it has been loaded. It is overwritten in place,
+      # so its mtime does not identify the module and the import is not
+      # cached.
       sm_path = os.path.join(FLAGS.debug_dir, "SavedModel")
+      with _saved_model_lock:
+        tf.saved_model.save(tf_module, sm_path, options=options)
+        return _compile_from_path(
+            sm_path, exported_names, target_backends, cache_import=False)
+
+
+def _make_saved_model_dir(ctor):
+  """Creates the directory that ctor's SavedModel is saved to."""
+  if FLAGS.debug_dir is None:
+    sm_path = tempfile.mkdtemp(prefix="SavedModel_")
+    atexit.register(shutil.rmtree, sm_path, ignore_errors=True)
+    return sm_path
+  ctor_name = _SANITIZE_NAME_RE.sub("_", getattr(ctor, "__qualname__",
+                                                "module"))
+  sm_path = os.path.join(FLAGS.debug_dir, "SavedModel__%s" % ctor_name)
+  if any(path == sm_path for _, path in _saved_model_path_cache.values()):
+    # Another ctor in this process has the same name.
+    sm_path = tempfile.mkdtemp(
+        prefix="SavedModel__%s_" % ctor_name, dir=FLAGS.debug_dir)
+  return sm_path
+
+
+def _get_saved_model_path(ctor):
+  """Returns the path of a SavedModel of ctor(), saving it on first use.
+
+  The SavedModel is shared by every backend compiling ctor, so the module is
+  only constructed and saved once per process.
+
+  Args:
+    ctor: The tf.Module constructor.
+
+  Returns:
+    The SavedModel path.
+  """
+  # ctor() must run under the lock: constructors commonly call
+  # set_random_seed() and then draw initial values from the process global
+  # RNGs, which concurrent constructions would interleave.
+  with _saved_model_lock:
+    cached = _saved_model_path_cache.get(id(ctor))
+    if cached is not None and cached[0] is ctor:
+      return cached[1]
+
+    tf_module = ctor()
+    if hasattr(tf_module, ORIGINAL_SAVED_MODEL_PATH_ATTR):
+      sm_path = getattr(tf_module, ORIGINAL_SAVED_MODEL_PATH_ATTR)
+      logging.info(
+          "Compiling from original saved_model path (not round-tripping): %s",
+          sm_path)
+    else:
+      sm_path = _make_saved_model_dir(ctor)
+      options = tf.saved_model.SaveOptions(save_debug_info=True)
       tf.saved_model.save(tf_module, sm_path, options=options)
-      return compile_from_path(sm_path)
+    # The ctor is retained so that its id cannot be reused.
+    _saved_model_path_cache[id(ctor)] = (ctor, sm_path)
+    return sm_path
 
 
 def load_tf_module(path):
@@ -198,7 +427,35 @@ class _TfModuleInstance(object):
     if not f or not hasattr(f, "__call__"):
       raise AttributeError(
           "The TensorFlow module does not have a callable attr '%s'" % (attr,))
-    return _TfFunctionWrapper(f)
+    # Cache the wrapper so subsequent lookups bypass __getattr__.
+    wrapper = _TfFunctionWrapper(f)
+    self.__dict__[attr] = wrapper
+    return wrapper
+
+
+def _tensor_to_numpy(t):
+  """Converts an eager tf.Tensor to numpy without redundant copies.
+
+  Tensor.numpy() copies the array backing the tensor. np.asarray() uses
+  __array__, which aliases the host buffer of CPU tensors and only makes the
+  device to host copy for tensors on other devices.
+
+  TensorFlow may forward buffers between tensors (e.g. the result of reading a
+  tf.Variable), so the returned array is read-only to keep in-place edits from
+  silently changing TensorFlow state.
+
+  Args:
+    t: An eager tf.Tensor.
+
+  Returns:
+    A read-only numpy array, or a numpy scalar for rank 0 tensors (as
+    Tensor.numpy() returns).
+  """
+  array = np.asarray(t)
+  if array.ndim == 0:
+    return array[()]
+  array.flags.writeable = False
+  return array
 
 
 class _TfFunctionWrapper(object):
@@ -215,10 +472,18 @@ class _TfFunctionWrapper(object):
     # which is sad).
     if not isinstance(results, tuple):
       results = (results,)
-    return tf.nest.map_structure(
-        lambda t: t.numpy() if isinstance(t, tf.Tensor) else t,
-        *results,
-        check_types=False)
+    # Only use tf.nest (which is comparatively slow) for nested results. This
+    # is checked on every call since the structure may differ between calls.
+    if any(isinstance(t, (dict, list, tuple)) for t in results):
+      results = tf.nest.map_structure(
+          lambda t: _tensor_to_numpy(t) if isinstance(t, tf.Tensor) else t,
+          results,
+          check_types=False)
+    else:
+      results = tuple(
+          _tensor_to_numpy(t) if isinstance(t, tf.Tensor) else t
+          for t in results)
+    return results[0] if len(results) == 1 else results
 
 
 class IreeCompiledModule(CompiledModule):
@@ -226,14 +491,29 @@ class IreeCompiledModule(CompiledModule):
 
   def __init__(self, ctor, exported_names, backend):
     super().__init__(ctor, exported_names, backend)
-    self._iree_module_blob = save_and_compile_tf_module(
-        ctor(),
-        exported_names=exported_names,
-        target_backends=backend.iree_compiler_targets)
-    self._iree_module = rt.VmModule.from_flatbuffer(self._iree_module_blob)
+    target_backends = backend.iree_compiler_targets
+    # Compiling is far more expensive than looking the result up on disk (if
+    # --compile_cache_dir is set).
+    self._iree_module_buffer = _compile_cache.get_or_compile(
+        ctor,
+        exported_names,
+        target_backends,
+        compile_fn=lambda: _compile_from_path(
+            _get_saved_model_path(ctor),
+            exported_names,
+            target_backends,
+            cache_import=_share_imported_modules),
+        cache_dir=FLAGS.compile_cache_dir,
+        debug_artifacts=_get_debug_artifact_paths(target_backends) or ())
+    self._iree_module = rt.VmModule.from_flatbuffer(self._iree_module_buffer)
+
+  @property
+  def _iree_module_blob(self):
+    # Only copied out of the memory map for callers that need bytes.
+    return bytes(self._iree_module_buffer)
 
   def instantiate(self):
-    return _IreeModuleInstance(self._backend, self._iree_module_blob,
+    return _IreeModuleInstance(self._backend, self._iree_module_buffer,
                                self._iree_module)
 
 
@@ -249,12 +529,15 @@ class _IreeModuleInstance(object):
     self._system_config = rt.Config(driver_name=backend.iree_driver)
     self._context = rt.SystemContext(
         modules=[self._iree_module], config=self._system_config)
+    self._bound_module = self._context.modules[self._iree_module_name]
 
   def __getattr__(self, attr):
     # Try to resolve it as a function.
-    m = self._context.modules[self._iree_module_name]
-    f = m[attr]
-    return _IreeFunctionWrapper(self._context, f)
+    f = self._bound_module[attr]
+    # Cache the wrapper so subsequent lookups bypass __getattr__.
+    wrapper = _IreeFunctionWrapper(self._context, f)
+    self.__dict__[attr] = wrapper
+    return wrapper
 
 
 class _IreeFunctionWrapper(object):
@@ -297,6 +580,12 @@ class _VirtualModuleInstance(object):
     return _VirtualFunctionWrapper(match_functions)
 
 
+# Executor used to invoke a function on multiple backends concurrently. The
+# TensorFlow and IREE runtimes release the GIL while executing.
+_BACKEND_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=max(4, os.cpu_count() or 1))
+
+
 class _VirtualFunctionWrapper(object):
   """Wrapper around a virtual dict of functions."""
 
@@ -304,79 +593,239 @@ class _VirtualFunctionWrapper(object):
     self._backend_function_dict = backend_function_dict
 
   def __call__(self, *args, **kwargs):
-    all_results = {
+    # The IREE backends are independent, so they are invoked concurrently.
+    # TensorFlow eager state (e.g. tf.device and name scopes, gradient tapes)
+    # is thread-local, and unseeded random ops draw from a global op seed
+    # counter, so the TensorFlow backends run in order on the calling thread.
+    futures = {
+        backend: _BACKEND_EXECUTOR.submit(f, *args, **kwargs)
+        for backend, f in self._backend_function_dict.items()
+        if not isinstance(f, _TfFunctionWrapper)
+    }
+    tf_results = {
         backend: f(*args, **kwargs)
         for backend, f in self._backend_function_dict.items()
+        if isinstance(f, _TfFunctionWrapper)
+    }
+    all_results = {
+        backend: (tf_results[backend]
+                  if backend in tf_results else futures[backend].result())
+        for backend in self._backend_function_dict
     }
     # Turn it into a named tuple so we get nice class-like access to it.
-    results_tuple_class = collections.namedtuple("Results", all_results.keys())
-    return _make_multi_result_class(results_tuple_class)(*all_results.values())
-
-
-def _recursive_check_same(result_ref, result_tgt, rtol=1e-6, atol=1e-6):
-  same = True
-  if not isinstance(result_tgt, type(result_ref)):
-    raise ValueError("Types of the outputs must be the same, but have '{}' and "
-                     "'{}'".format(type(result_ref), type(result_tgt)))
-  if isinstance(result_ref, dict):
-    if result_ref.keys() != result_tgt.keys():
-      raise ValueError("Outputs must have the same structure, but have '{}' and"
-                       " '{}'".format(result_ref.keys(), result_tgt.keys()))
-    for key in result_ref.keys():
-      same = same and _recursive_check_same(result_ref[key], result_tgt[key],
-                                            rtol, atol)
-      if not same:
-        return False  # no need to go further they are different
-  elif isinstance(result_ref, list):
-    if len(result_ref) != len(result_tgt):
-      raise ValueError("Outputs must have the same structure, but have '{}' and"
-                       " '{}'".format(result_ref, result_tgt))
-    for i in range(len(result_ref)):
-      same = same and _recursive_check_same(result_ref[i], result_tgt[i], rtol,
-                                            atol)
-      if not same:
-        return False  # no need to go further they are different
-  elif isinstance(result_ref, np.ndarray):
-    if isinstance(result_ref.flat[0], np.floating):
-      return np.allclose(result_ref, result_tgt, rtol=rtol, atol=atol)
+    multi_result_class = _get_multi_result_class(tuple(all_results.keys()))
+    return multi_result_class(*all_results.values())
+
+
+def _flatten_result_pairs(result_ref, result_tgt):
+  """Flattens two nested results into a list of corresponding leaf pairs.
+
+  Args:
+    result_ref: The reference result, a nest of dicts, lists and leaves.
+    result_tgt: The target result, which must have the same structure.
+
+  Returns:
+    A list of (leaf_ref, leaf_tgt) tuples in depth first order.
+
+  Raises:
+    ValueError: if the structures of the results differ.
+  """
+  leaf_pairs = []
+  stack = [(result_ref, result_tgt)]
+  while stack:
+    ref, tgt = stack.pop()
+    if not isinstance(tgt, type(ref)):
+      raise ValueError("Types of the outputs must be the same, but have '{}' "
+                       "and '{}'".format(type(ref), type(tgt)))
+    if isinstance(ref, dict):
+      if ref.keys() != tgt.keys():
+        raise ValueError("Outputs must have the same structure, but have '{}' "
+                         "and '{}'".format(ref.keys(), tgt.keys()))
+      stack.extend((ref[key], tgt[key]) for key in reversed(list(ref.keys())))
+    elif isinstance(ref, list):
+      if len(ref) != len(tgt):
+        raise ValueError("Outputs must have the same structure, but have '{}' "
+                         "and '{}'".format(ref, tgt))
+      stack.extend(zip(reversed(ref), reversed(tgt)))
+    else:
+      leaf_pairs.append((ref, tgt))
+  return leaf_pairs
+
+
+def _allclose(a, b, rtol=1e-6, atol=1e-6, chunk_size=1 << 20):
+  """Equivalent of np.allclose that bounds temporaries and exits early.
+
+  np.allclose materializes several full size temporaries before reducing. This
+  compares the arrays chunk_size elements at a time instead (in memory order),
+  stopping at the first chunk that differs. Integer and boolean arrays are
+  compared exactly.
+
+  Args:
+    a: The first array_like to compare.
+    b: The second array_like to compare.
+    rtol: The relative tolerance parameter.
+    atol: The absolute tolerance parameter.
+    chunk_size: The number of elements compared at once.
+
+  Returns:
+    Whether all elements of a and b are close.
+  """
+  a = np.asarray(a)
+  b = np.asarray(b)
+  if a.shape != b.shape:
+    # Let numpy handle broadcasting.
+    return np.allclose(a, b, rtol=rtol, atol=atol)
+  if a.dtype.kind in "iub" and b.dtype.kind in "iub":
+    return np.array_equal(a, b)
+  # A buffered nditer yields chunks of at most chunk_size elements without
+  # copying whole arrays, even when they are not contiguous (e.g. transposed).
+  it = np.nditer([a, b],
+                 flags=["external_loop", "buffered", "zerosize_ok", "refs_ok"],
+                 op_flags=[["readonly"], ["readonly"]],
+                 buffersize=chunk_size)
+  for a_chunk, b_chunk in it:
+    if not np.allclose(a_chunk, b_chunk, rtol=rtol, atol=atol):
+      return False
+  return True
+
+
+def _check_same_leaf(leaf_ref, leaf_tgt, rtol, atol):
+  if isinstance(leaf_ref, np.ndarray):
+    if np.issubdtype(leaf_ref.dtype, np.floating):
+      return _allclose(leaf_ref, leaf_tgt, rtol=rtol, atol=atol)
     else:
-      return np.array_equal(result_ref, result_tgt)
+      return np.array_equal(leaf_ref, leaf_tgt)
   else:
     # this one need more checks
-    return result_ref == result_tgt
-  return same
+    return leaf_ref == leaf_tgt
 
 
-def _collect_disagreements_recursively(mr, rtol=1e-6, atol=1e-6):
-  """Compare result structs recursively and search for disagreements.
+def _batch_kind(leaf_ref, leaf_tgt):
+  """Returns "float" or "int" if the leaves can be compared in a batch."""
+  if (not isinstance(leaf_ref, np.ndarray) or
+      leaf_ref.shape != leaf_tgt.shape or
+      leaf_ref.size > _MAX_BATCHED_LEAF_SIZE):
+    return None
+  if (np.issubdtype(leaf_ref.dtype, np.floating) and
+      leaf_tgt.dtype.kind in "biuf"):
+    return "float"
+  if leaf_ref.dtype.kind in "iub" and leaf_ref.dtype == leaf_tgt.dtype:
+    return "int"
+  return None
+
+
+def _concatenate_leaves(result, leaves, indices, dtype, flat_cache):
+  """Concatenates leaves[indices] of result as dtype, memoized in flat_cache.
+
+  Args:
+    result: The result the leaves were flattened from.
+    leaves: The flattened leaves of result.
+    indices: Tuple of indices of the leaves to concatenate.
+    dtype: The dtype to cast the leaves to.
+    flat_cache: None, or a dict mapping (id(result), dtype, indices) to the
+      concatenated leaves. The results must be kept alive while it is used.
+
+  Returns:
+    A flat numpy array.
+  """
+  key = (id(result), dtype, indices)
+  if flat_cache is not None and key in flat_cache:
+    return flat_cache[key]
+  flat = np.concatenate(
+      [leaves[i].ravel().astype(dtype, copy=False) for i in indices])
+  if flat_cache is not None:
+    flat_cache[key] = flat
+  return flat
+
+
+def _recursive_check_same(result_ref,
+                          result_tgt,
+                          rtol=1e-6,
+                          atol=1e-6,
+                          flat_cache=None):
+  leaf_pairs = _flatten_result_pairs(result_ref, result_tgt)
+
+  # Comparing many small arrays is dominated by per call overhead, so small
+  # float and integer leaves are concatenated and compared in one call each.
+  batches = {"float": [], "int": []}
+  unbatched_pairs = []
+  for i, (leaf_ref, leaf_tgt) in enumerate(leaf_pairs):
+    kind = _batch_kind(leaf_ref, leaf_tgt)
+    if kind:
+      batches[kind].append(i)
+    else:
+      unbatched_pairs.append((leaf_ref, leaf_tgt))
+  leaves_ref, leaves_tgt = zip(*leaf_pairs) if leaf_pairs else ((), ())
+  for kind, dtype in (("float", np.float64), ("int", np.int64)):
+    indices = tuple(batches[kind])
+    if len(indices) < 2:
+      unbatched_pairs.extend(leaf_pairs[i] for i in indices)
+      continue
+    flat_ref = _concatenate_leaves(result_ref, leaves_ref, indices, dtype,
+                                   flat_cache)
+    flat_tgt = _concatenate_leaves(result_tgt, leaves_tgt, indices, dtype,
+                                   flat_cache)
+    if not _check_same_leaf(flat_ref, flat_tgt, rtol, atol):
+      return False
+
+  # Stops at the first leaf that differs.
+  return all(
+      _check_same_leaf(leaf_ref, leaf_tgt, rtol, atol)
+      for leaf_ref, leaf_tgt in unbatched_pairs)
+
+
+def _group_equivalent_results(mr, predicate):
+  """Partitions the entries of mr into groups of equivalent results.
+
+  Each entry is only compared against the first member of every group found
+  so far, so when all backends agree just len(mr) - 1 comparisons are made.
 
   Args:
     mr: A MultiResults namedtuple where each entry corresponds to a backend set
       of results.
-    rtol: The relative tolerance parameter.
-    atol: The absolute tolerance parameter.
+    predicate: A predicate function which takes (a, b) and returns whether they
+      should be considered equivalent.
 
   Returns:
-    An equivalent MultiResults where each entry is an array of result names
-    that disagree.
+    A list of groups, each a list of indices into mr.
   """
+  groups = []
+  for i, result in enumerate(mr):
+    for group in groups:
+      if predicate(mr[group[0]], result):
+        group.append(i)
+        break
+    else:
+      groups.append([i])
+  return groups
+
+
+@functools.lru_cache(maxsize=None)
+def _get_disagreements_class(fields):
+  return collections.namedtuple("Disagreements", fields)
+
+
+def _collect_disagreements_pairwise(mr, predicate):
+  """Verifies that result structs agree by comparing every pair of them."""
   has_disagreement = False
   disagreement_list = [list() for _ in mr]
   for i in range(len(mr)):
-    result_ref = mr[i]
     for j in range(len(mr)):
-      if i < j:
-        continue  # Don't check self and reverse comparisons
-      result_tgt = mr[j]
-      if not _recursive_check_same(result_ref, result_tgt, rtol, atol):
+      if i != j and not predicate(mr[i], mr[j]):
         has_disagreement = True
         disagreement_list[i].append(mr._fields[j])
-  disagreements_tuple = collections.namedtuple("Disagreements", mr._fields)
+  disagreements_tuple = _get_disagreements_class(mr._fields)
   return has_disagreement, disagreements_tuple(*disagreement_list)
 
 
 def _collect_disagreements(mr, predicate):
-  """Verifies that result structs.
+  """Verifies that result structs agree.
+
+  Results are grouped by comparing them against the first member of each
+  group. Tolerance based predicates are not transitive (a may be close to
+  both b and c while b and c are not close), so the other members of groups
+  with more than two results are also compared with each other. If any of
+  them disagree, every pair of results is compared instead.
 
   Args:
     mr: A MultiResults namedtuple where each entry corresponds to a backend set
@@ -388,19 +837,40 @@ def _collect_disagreements(mr, predicate):
     An equivalent MultiResults where each entry is an array of result names
     that disagree.
   """
-  has_disagreement = False
+  groups = _group_equivalent_results(mr, predicate)
+  for group in groups:
+    for j in range(1, len(group)):
+      for k in range(j + 1, len(group)):
+        if not predicate(mr[group[j]], mr[group[k]]):
+          return _collect_disagreements_pairwise(mr, predicate)
   disagreement_list = [list() for _ in mr]
-  for i in range(len(mr)):
-    result_ref = mr[i]
-    for j in range(len(mr)):
-      if i == j:
-        continue  # Don't check self.
-      result_tgt = mr[j]
-      if not predicate(result_ref, result_tgt):
-        has_disagreement = True
-        disagreement_list[i].append(mr._fields[j])
-  disagreements_tuple = collections.namedtuple("Disagreements", mr._fields)
-  return has_disagreement, disagreements_tuple(*disagreement_list)
+  for group in groups:
+    for i in group:
+      disagreement_list[i] = [
+          mr._fields[j] for j in range(len(mr)) if j not in group
+      ]
+  disagreements_tuple = _get_disagreements_class(mr._fields)
+  return len(groups) > 1, disagreements_tuple(*disagreement_list)
+
+
+def _collect_disagreements_recursively(mr, rtol=1e-6, atol=1e-6):
+  """Compare result structs recursively and search for disagreements.
+
+  Args:
+    mr: A MultiResults namedtuple where each entry corresponds to a backend set
+      of results.
+    rtol: The relative tolerance parameter.
+    atol: The absolute tolerance parameter.
+
+  Returns:
+    An equivalent MultiResults where each entry is an array of result names
+    that disagree.
+  """
+  # Each result is compared against several others, so its batched leaves are
+  # only concatenated once.
+  flat_cache = {}
+  return _collect_disagreements(
+      mr, lambda a, b: _recursive_check_same(a, b, rtol, atol, flat_cache))
 
 
 def _make_multi_result_class(named_tuple_class):
@@ -410,7 +880,7 @@ def _make_multi_result_class(named_tuple_class):
     """Wraps a mapping of results."""
 
     def assert_all_close(self, rtol=1e-6, atol=1e-6):
-      predicate = (lambda a, b: np.allclose(a, b, rtol=rtol, atol=atol))
+      predicate = (lambda a, b: _allclose(a, b, rtol=rtol, atol=atol))
       has_disagreement, disagreements = _collect_disagreements(self, predicate)
       assert not has_disagreement, ("Multiple backends disagree (%r):\n%r" %
                                     (disagreements, self))
@@ -443,14 +913,19 @@ def _make_multi_result_class(named_tuple_class):
           result = self[i]  # output generated by a model
           field = self._fields[i]  # backend name
           fname = os.path.join(FLAGS.debug_dir, "output_{}".format(field))
-          with open(fname, "w") as file:
-            # content of txt file can be converted to py objects by eval(txt)
-            file.write(str(result))
+          # content of txt file can be converted to py objects by eval(txt)
+          _write_if_changed(fname, str(result))
       return self
 
   return MultiResults
 
 
+@functools.lru_cache(maxsize=None)
+def _get_multi_result_class(fields):
+  """Returns the (shared) MultiResults class for a tuple of backend names."""
+  return _make_multi_result_class(collections.namedtuple("Results", fields))
+
+
 def _instantiate_modules(compiled_modules_dict):
   """Given a dict of modules, instantiates them.
 
@@ -535,6 +1010,25 @@ def compile_modules(**kwargs):
   return decorator
 
 
+@functools.lru_cache(maxsize=32)
+def _parse_target_backends(target_backends):
+  """Decodes a comma-delimited string of backends into BackendInfo objects.
+
+  The result is cached; BackendInfo.add clears the cache.
+  """
+  backend_names = target_backends.split(",")
+  unknown_names = [
+      name for name in backend_names if name not in BackendInfo.ALL
+  ]
+  if unknown_names:
+    raise ValueError(
+        "Invalid backend specification string '{}', unexpected names '{}';"
+        " valid names are '{}'".format(target_backends,
+                                       ", ".join(unknown_names),
+                                       ", ".join(BackendInfo.ALL.keys())))
+  return tuple(BackendInfo.ALL[name] for name in backend_names)
+
+
 class BackendInfo(
     collections.namedtuple(
         "BackendInfo",
@@ -548,6 +1042,8 @@ class BackendInfo(
   def add(cls, **kwargs):
     backend_info = cls(**kwargs)
     cls.ALL[backend_info.name] = backend_info
+    # Don't return stale BackendInfos from previously parsed specifications.
+    _parse_target_backends.cache_clear()
 
 
 BackendInfo.add(
@@ -579,19 +1075,6 @@ BackendInfo.add(
     iree_compiler_targets=["llvm-ir"])
 
 
-def _parse_target_backends(target_backends):
-  """Decodes a comma-delimited string of backends into BackendInfo objects."""
-  backends = []
-  for backend_name in target_backends.split(","):
-    if backend_name not in BackendInfo.ALL.keys():
-      raise ValueError(
-          "Invalid backend specification string '{}', unexpected name '{}';"
-          " valid names are '{}'".format(target_backends, backend_name,
-                                         BackendInfo.ALL.keys()))
-    backends.append(BackendInfo.ALL[backend_name])
-  return backends
-
-
 def get_backends():
   """Gets the BackendInfo instances to test.
 
@@ -604,7 +1087,7 @@ def get_backends():
   """
   if FLAGS.target_backends is not None:
     logging.info("Using backends from command line: %s", FLAGS.target_backends)
-    backends = _parse_target_backends(FLAGS.target_backends)
+    backends = list(_parse_target_backends(FLAGS.target_backends))
     # If tf is the only backend then we will test it itself by adding tf_also.
     if len(backends) == 1 and "tf" == backends[0].name:
       backends.append(BackendInfo.ALL["tf_also"])
@@ -635,39 +1118,54 @@ class SavedModelTestCase(tf.test.TestCase):
     cls.compiled_modules = {}
     if cls._modules_to_compile:
       for name, (ctor, exported_names) in cls._modules_to_compile.items():
-
-        # Setup the debug directory.
-        debug_parent_dir = FLAGS.debug_dir
-        if not debug_parent_dir:
-          debug_parent_dir = FLAGS.test_tmpdir
-        debug_parent_dir = os.path.join(debug_parent_dir, cls.__name__)
-
-        try:
-          os.makedirs(debug_parent_dir)
-        except IOError:
-          logging.exception("Error creating crash reproducer dir for: %s",
-                            debug_parent_dir)
-
-        # Setup crash reproducer and global debug dir.
-        crash_reproducer_path = os.path.join(debug_parent_dir,
-                                             name + "_reproducer.mlir")
-        compiler.Context.default_crash_reproducer_path = crash_reproducer_path
         global global_debug_dir
-        global_debug_dir = debug_parent_dir
+        global _share_imported_modules
+
+        if FLAGS.dump_debug_artifacts:
+          # Setup the debug directory.
+          debug_parent_dir = FLAGS.debug_dir
+          if not debug_parent_dir:
+            debug_parent_dir = FLAGS.test_tmpdir
+          debug_parent_dir = os.path.join(debug_parent_dir, cls.__name__)
+
+          try:
+            os.makedirs(debug_parent_dir)
+          except IOError:
+            logging.exception("Error creating crash reproducer dir for: %s",
+                              debug_parent_dir)
+
+          # Setup crash reproducer and global debug dir.
+          crash_reproducer_path = os.path.join(debug_parent_dir,
+                                               name + "_reproducer.mlir")
+          compiler.Context.default_crash_reproducer_path = (
+              crash_reproducer_path)
+          global_debug_dir = debug_parent_dir
 
         try:
-          # Compile.
+          # Compile for each backend in parallel. The compiler releases the GIL
+          # and the process global debug state above is only changed between
+          # modules, so threads are sufficient.
           backends = get_backends()
-          cls.compiled_modules[name] = dict([
-              (backend.name, CompiledModule.create(ctor, exported_names,
-                                                   backend))
-              for backend in backends
-          ])
+          _share_imported_modules = sum(
+              1 for backend in backends if backend.iree_compiler_targets) > 1
+          with concurrent.futures.ThreadPoolExecutor(
+              max_workers=len(backends)) as executor:
+            futures = [(backend.name,
+                        executor.submit(CompiledModule.create, ctor,
+                                        exported_names, backend))
+                       for backend in backends]
+            cls.compiled_modules[name] = dict([
+                (backend_name, future.result())
+                for backend_name, future in futures
+            ])
         finally:
           # Disable crash reproducer (to avoid inadvertently overwriting this
           # path on a subsequent interaction).
           compiler.Context.default_crash_reproducer_path = None
           global_debug_dir = None
+          _share_imported_modules = True
+          # The import is only shared by this module's backends.
+          _clear_imported_module_cache()
 
   @classmethod
   def tearDownClass(cls):
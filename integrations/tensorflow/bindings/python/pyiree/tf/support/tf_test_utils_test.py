@@ -14,6 +14,9 @@
 # limitations under the License.
 """Tests for pyiree.tf.support.tf_test_utils."""
 
+import collections
+import os
+
 from absl.testing import parameterized
 import numpy as np
 from pyiree.tf.support import tf_test_utils
@@ -78,6 +81,162 @@ class UtilsTests(tf.test.TestCase, parameterized.TestCase):
     same = tf_test_utils._recursive_check_same(ref, tgt)
     self.assertEqual(tgt_same, same)
 
+  def _make_batched_result(self):
+    return {
+        'f32': np.array([0.0, 0.1], dtype=np.float32),
+        'f64': [np.array([1.0, 2.0]), np.array([[3.0], [4.0]])],
+        'i': np.array([1, 2], dtype=np.int32),
+        'u': np.array([3], dtype=np.uint8),
+        'b': np.array([True, False]),
+        'big': np.zeros(tf_test_utils._MAX_BATCHED_LEAF_SIZE + 1),
+    }
+
+  @parameterized.named_parameters([
+      ('same', None, None, True),
+      ('float_within_tolerance', 'f32', lambda x: x + 1e-9, True),
+      ('wrong non-first float', 'f64', lambda x: [x[0], x[1] + 1.0], False),
+      ('wrong non-first int', 'u', lambda x: x + 1, False),
+      ('wrong bool', 'b', np.logical_not, False),
+      ('wrong oversized leaf', 'big', lambda x: x + 1.0, False),
+  ])
+  def test_recursive_check_same_batched(self, key, update, tgt_same):
+    ref = self._make_batched_result()
+    tgt = self._make_batched_result()
+    if key:
+      tgt[key] = update(tgt[key])
+    self.assertEqual(tgt_same, tf_test_utils._recursive_check_same(ref, tgt))
+
+  def test_recursive_check_same_flat_cache(self):
+    ref = self._make_batched_result()
+    tgt = self._make_batched_result()
+    tgt_also = self._make_batched_result()
+    flat_cache = {}
+    self.assertTrue(
+        tf_test_utils._recursive_check_same(ref, tgt, flat_cache=flat_cache))
+    # One float and one int buffer for each result.
+    self.assertLen(flat_cache, 4)
+    self.assertTrue(
+        tf_test_utils._recursive_check_same(
+            ref, tgt_also, flat_cache=flat_cache))
+    # The buffers of ref are reused.
+    self.assertLen(flat_cache, 6)
+
+  def test_allclose(self):
+    a = np.linspace(0.0, 1.0, 10, dtype=np.float32)
+    b = a.copy()
+    self.assertTrue(tf_test_utils._allclose(a, b, chunk_size=3))
+    b[-1] += 1e-3
+    self.assertFalse(tf_test_utils._allclose(a, b, chunk_size=3))
+    self.assertTrue(
+        tf_test_utils._allclose(a, b, rtol=0.0, atol=1e-2, chunk_size=3))
+
+    # Non-contiguous arrays.
+    a = np.arange(12, dtype=np.float64).reshape(3, 4)
+    self.assertTrue(tf_test_utils._allclose(a.T, a.T.copy(), chunk_size=5))
+    b = a.copy()
+    b[2, 2] += 1.0
+    self.assertFalse(tf_test_utils._allclose(a.T, b.T, chunk_size=5))
+    self.assertFalse(
+        tf_test_utils._allclose(a[:, ::2], b[:, ::2], chunk_size=5))
+    self.assertTrue(
+        tf_test_utils._allclose(a[:, ::2], a[:, ::2].astype(np.float32)))
+
+    # Integers are compared exactly.
+    self.assertFalse(
+        tf_test_utils._allclose(
+            np.array([10000000]), np.array([10000001]), rtol=1e-6))
+
+  def test_collect_disagreements(self):
+    results = collections.namedtuple('Results', ['a', 'b', 'c', 'd'])
+    mr = results(
+        np.array([0, 1, 2]), np.array([0, 1, 2]), np.array([1, 1, 2]),
+        np.array([0, 1, 2]))
+    has_disagreement, disagreements = tf_test_utils._collect_disagreements(
+        mr, np.array_equal)
+    self.assertTrue(has_disagreement)
+    self.assertEqual(['c'], disagreements.a)
+    self.assertEqual(['c'], disagreements.d)
+    self.assertEqual(['a', 'b', 'd'], disagreements.c)
+
+    mr = results(*[np.array([0, 1, 2])] * 4)
+    has_disagreement, disagreements = tf_test_utils._collect_disagreements(
+        mr, np.array_equal)
+    self.assertFalse(has_disagreement)
+    self.assertEqual([], disagreements.b)
+
+    # Closeness is not transitive: a is close to b and c, which are not close.
+    results = collections.namedtuple('Results', ['a', 'b', 'c'])
+    has_disagreement, disagreements = tf_test_utils._collect_disagreements(
+        results(0.0, 1.0, -1.0), lambda x, y: abs(x - y) <= 1.0)
+    self.assertTrue(has_disagreement)
+    self.assertEqual([], disagreements.a)
+    self.assertEqual(['c'], disagreements.b)
+    self.assertEqual(['b'], disagreements.c)
+
+  def test_write_if_changed(self):
+    path = os.path.join(self.create_tempdir().full_path, 'artifact.mlir')
+    tf_test_utils._write_if_changed(path, 'module')
+    with open(path) as f:
+      self.assertEqual('module', f.read())
+
+    # Unchanged content is not rewritten.
+    sig_mtime_ns = os.stat(path + '.sig').st_mtime_ns
+    os.utime(path, ns=(sig_mtime_ns - 10**9, sig_mtime_ns - 10**9))
+    tf_test_utils._write_if_changed(path, 'module')
+    self.assertEqual(sig_mtime_ns - 10**9, os.stat(path).st_mtime_ns)
+
+    # An external edit, even one keeping the size and the mtime tick of the
+    # signature, is overwritten.
+    with open(path, 'w') as f:
+      f.write('edited')
+    os.utime(path, ns=(sig_mtime_ns, sig_mtime_ns))
+    tf_test_utils._write_if_changed(path, 'module')
+    with open(path) as f:
+      self.assertEqual('module', f.read())
+
+  def test_tf_function_wrapper_tuple_result(self):
+    wrapper = tf_test_utils._TfFunctionWrapper(
+        lambda: (tf.constant([1.0]), tf.constant([2, 3])))
+    result = wrapper()
+    self.assertIsInstance(result, tuple)
+    self.assertLen(result, 2)
+    self.assertIsInstance(result[0], np.ndarray)
+    self.assertAllEqual([1.0], result[0])
+    self.assertAllEqual([2, 3], result[1])
+
+  def test_tf_function_wrapper_dict_result(self):
+    wrapper = tf_test_utils._TfFunctionWrapper(
+        lambda: {'a': tf.constant([1.0]), 'b': [tf.constant(2)]})
+    result = wrapper()
+    self.assertIsInstance(result, dict)
+    self.assertIsInstance(result['a'], np.ndarray)
+    self.assertAllEqual([1.0], result['a'])
+    self.assertIsInstance(result['b'][0], np.generic)
+
+  def test_tf_function_wrapper_changing_structure(self):
+    results = [(tf.constant([1.0]), tf.constant([2.0])),
+               (tf.constant([1.0]), {'a': tf.constant([2.0])})]
+    wrapper = tf_test_utils._TfFunctionWrapper(lambda: results.pop(0))
+    wrapper()
+    result = wrapper()
+    self.assertIsInstance(result[1]['a'], np.ndarray)
+
+  def test_tensor_to_numpy(self):
+    array = tf_test_utils._tensor_to_numpy(tf.constant([1.0, 2.0]))
+    self.assertIsInstance(array, np.ndarray)
+    self.assertAllEqual([1.0, 2.0], array)
+    self.assertFalse(array.flags.writeable)
+
+    scalar = tf_test_utils._tensor_to_numpy(tf.constant(1.0))
+    self.assertIsInstance(scalar, np.generic)
+    self.assertEqual(np.float32(1.0), scalar)
+
+  def test_parse_target_backends(self):
+    backends = tf_test_utils._parse_target_backends('tf,iree_vmla')
+    self.assertEqual(['tf', 'iree_vmla'], [b.name for b in backends])
+    with self.assertRaisesRegex(ValueError, "unexpected names 'foo, bar'"):
+      tf_test_utils._parse_target_backends('tf,foo,bar')
+
 
 if __name__ == '__main__':
   tf.test.main()